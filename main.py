@@ -3,11 +3,10 @@ import argparse
 import csv
 import os
 import random
-import re
 import logging
 from pyppeteer import launch
 from contextlib import asynccontextmanager
-from utils import get_browser_instance, handle_qr_scan
+from utils import CSV_READ_BUFFER, DIGIT_TABLE, PAGE_POOL_SIZE, PagePool, disconnect_browser, get_browser_instance, handle_qr_scan, uvloop_loop_factory, wait_any
 
 # Configure logging
 logging.basicConfig(
@@ -17,26 +16,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Inserts text at the caret in one DevTools call instead of one key event per character
+INSERT_TEXT_JS = '''(element, text) => {
+    element.focus();
+    document.execCommand('insertText', false, text);
+}'''
+
 @asynccontextmanager
-async def get_browser_and_page():
+async def get_browser_and_pages(pool_size):
     """
-    Initializes the browser and page, handles QR scan, and ensures proper cleanup.
+    Initializes the browser and a pool of pages, handles QR scan, and ensures proper cleanup.
+
+    :param pool_size: int, number of pages to open on the logged-in browser
     """
+    page = pool = None
     try:
         browser = await get_browser_instance()
         page = await browser.newPage()
         await handle_qr_scan(page)
-        yield page
+        pool = await PagePool.create(browser, page, pool_size)
+        yield pool
     except Exception as e:
-        logger.error(f"Error initializing browser and page: {e}")
+        logger.error(f"Error initializing browser and pages: {e}")
         raise
     finally:
+        # The browser stays running for the next run, so close every tab this run opened
+        try:
+            if pool is not None:
+                await pool.close()
+            elif page is not None:
+                await page.close()
+        except Exception as e:
+            logger.error(f"Error closing pages: {e}")
         try:
-            await page.close()
-            await browser.close()
-            logger.info("Browser and page closed successfully.")
+            await disconnect_browser()
+            logger.info("Pages closed and browser disconnected successfully.")
         except Exception as e:
-            logger.error(f"Error closing browser/page: {e}")
+            logger.error(f"Error disconnecting browser: {e}")
 
 def append_number_to_file(number, filename, include_reason=False, reason=''):
     """
@@ -58,27 +74,23 @@ def append_number_to_file(number, filename, include_reason=False, reason=''):
     except Exception as e:
         logger.error(f"Failed to append number to {filename}: {e}")
 
-def read_phone_numbers_from_csv(file_path):
+def iter_phone_numbers_from_csv(file_path):
     """
-    Reads phone numbers from a CSV file and cleans them by removing '+' signs.
+    Yields phone numbers from a CSV file one row at a time, cleaned by removing '+' signs.
 
     :param file_path: str, path to the CSV file
-    :return: list of str, cleaned phone numbers
+    :return: iterator of str, cleaned phone numbers
     """
-    phone_numbers = []
     try:
-        with open(file_path, mode='r', newline='', encoding='utf-8') as file:
+        with open(file_path, mode='r', newline='', encoding='utf-8', buffering=CSV_READ_BUFFER) as file:
             reader = csv.reader(file)
-            headers = next(reader, None)  # Skip the header
+            next(reader, None)  # Skip the header
             for row in reader:
                 if row:
                     # Remove any non-digit characters, such as '+' signs
-                    clean_number = re.sub(r'\D', '', row[0])
-                    phone_numbers.append(clean_number)
-        logger.info(f"Read {len(phone_numbers)} phone numbers from {file_path}")
+                    yield row[0].translate(DIGIT_TABLE)
     except Exception as e:
         logger.error(f"Failed to read phone numbers from {file_path}: {e}")
-    return phone_numbers
 
 def read_message_from_text(file_path):
     """
@@ -101,20 +113,21 @@ def read_processed_numbers(file_path):
     Reads processed phone numbers from a CSV file and returns a set of successfully processed numbers.
 
     :param file_path: str, path to the CSV file
-    :return: set of str, processed phone numbers
+    :return: frozenset of str, processed phone numbers
     """
+    # Built row by row, and undecodable bytes are replaced, so a bad row never discards the others
     processed_numbers = set()
     try:
-        with open(file_path, mode='r', newline='', encoding='utf-8') as file:
+        with open(file_path, mode='r', newline='', encoding='utf-8', errors='replace', buffering=CSV_READ_BUFFER) as file:
             reader = csv.reader(file)
             next(reader, None)  # Skip the header
             for row in reader:
-                if row and row[1] == 'Sent successfully':
-                    processed_numbers.add(re.sub(r'\D', '', row[0]))
+                if len(row) > 1 and row[1] == 'Sent successfully':
+                    processed_numbers.add(row[0].translate(DIGIT_TABLE))
         logger.info(f"Read {len(processed_numbers)} processed phone numbers from {file_path}")
     except Exception as e:
         logger.error(f"Failed to read processed phone numbers from {file_path}: {e}")
-    return processed_numbers
+    return frozenset(processed_numbers)
 
 async def send_message(page, phone_number, message, writer):
     """
@@ -128,34 +141,33 @@ async def send_message(page, phone_number, message, writer):
     try:
         logger.info(f"Processing number: {phone_number}")
         chat_url = f'https://web.whatsapp.com/send?phone={phone_number}'
-        await page.goto(chat_url, {'waitUntil': 'networkidle0', 'timeout': 30000})  # Wait until network is idle
-        await asyncio.sleep(3)  # Wait 3 seconds before sending message
+        await page.goto(chat_url, {'waitUntil': 'domcontentloaded', 'timeout': 30000})
 
-        # Check for invalid number error
+        # Race the invalid number alert against the message box, whichever shows up first wins
         invalid_number_selector = 'div[role="alert"]'
-        try:
-            invalid_number_element = await page.waitForSelector(invalid_number_selector, timeout=10000)
-            if invalid_number_element:
-                error_message = await page.evaluate('(element) => element.textContent', invalid_number_element)
-                logger.warning(f"Invalid phone number {phone_number}. Skipping. Reason: {error_message}")
-                writer.writerow([phone_number, f'Failed - Invalid number: {error_message}'])
-                return
-        except asyncio.TimeoutError:
-            pass  # No invalid number error found, continue
+        message_box_selector = 'div[contenteditable="true"][data-tab="10"]'
+        winner, element = await wait_any(page, [invalid_number_selector, message_box_selector], timeout=15000)
 
-        try:
-            message_box = await page.waitForSelector('div[contenteditable="true"][data-tab="10"]', timeout=10000)
-        except asyncio.TimeoutError:
+        if winner == invalid_number_selector:
+            error_message = await page.evaluate('(element) => element.textContent', element)
+            logger.warning(f"Invalid phone number {phone_number}. Skipping. Reason: {error_message}")
+            writer.writerow([phone_number, f'Failed - Invalid number: {error_message}'])
+            return
+
+        if winner is None:
             logger.warning(f"Message box not found for {phone_number}. Skipping.")
             writer.writerow([phone_number, 'Failed'])
             return
-
-        # Type and send the message
-        for line in message.split('\n'):
-            await message_box.type(line)
-            await page.keyboard.down('Shift')
-            await page.keyboard.press('Enter')
-            await page.keyboard.up('Shift')
+        message_box = element
+
+        # Insert each line with a single call and join lines with Shift+Enter, then send.
+        # A single-line message is one insert call with no Shift+Enter at all.
+        for index, line in enumerate(message.split('\n')):
+            if index:
+                await page.keyboard.down('Shift')
+                await page.keyboard.press('Enter')
+                await page.keyboard.up('Shift')
+            await page.evaluate(INSERT_TEXT_JS, message_box, line)
         await message_box.press('Enter')
         await asyncio.sleep(random.choice([1, 2, 3]))  # Dynamic wait time
 
@@ -167,28 +179,71 @@ async def send_message(page, phone_number, message, writer):
         writer.writerow([phone_number, f'Failed - {e}'])
         await asyncio.sleep(10)  # Sleep for 10 seconds before retrying the next number
 
-async def send_messages_in_batches(page, phone_numbers, message, writer, batch_size=5):
+async def csv_producer(file_path, queue, processed_numbers, worker_count):
     """
-    Sends WhatsApp messages to phone numbers in batches sequentially to avoid concurrency issues.
+    Streams the numbers still to be sent from a CSV file into the queue.
 
-    :param page: pyppeteer page object
-    :param phone_numbers: list of str, phone numbers to send messages to
-    :param message: str, message to send
-    :param writer: csv.writer object, to write results
-    :param batch_size: int, number of numbers to process in each batch
-    """
-    total_numbers = len(phone_numbers)
-    logger.info(f"Starting to send messages to {total_numbers} numbers.")
+    Already processed and duplicate numbers are skipped. Once the file is exhausted,
+    one None sentinel per worker is queued so every worker stops.
 
-    for i in range(0, total_numbers, batch_size):
-        batch = phone_numbers[i:i+batch_size]
-        logger.info(f"Processing batch {i//batch_size + 1}: {len(batch)} number(s).")
+    :param file_path: str, path to the phone numbers CSV file
+    :param queue: asyncio.Queue feeding the send workers
+    :param processed_numbers: frozenset of str, numbers that were already sent
+    :param worker_count: int, number of workers consuming the queue
+    :return: int, number of phone numbers queued
+    """
+    queued = 0
+    seen = set()
+    try:
+        for phone_number in iter_phone_numbers_from_csv(file_path):
+            if phone_number in processed_numbers or phone_number in seen:
+                continue
+            seen.add(phone_number)
+            await queue.put(phone_number)
+            queued += 1
+        logger.info(f"Queued {queued} phone numbers from {file_path}")
+    finally:
+        for _ in range(worker_count):
+            await queue.put(None)
+    return queued
 
-        for phone_number in batch:
+async def _send_worker(page_pool, queue, message, writer):
+    """
+    Sends messages on a pooled page, taking numbers from the queue until it gets a None sentinel.
+    """
+    while True:
+        phone_number = await queue.get()
+        if phone_number is None:
+            return
+        page = await page_pool.acquire()
+        try:
             await send_message(page, phone_number, message, writer)
             await asyncio.sleep(1)  # Short pause between messages to mimic human behavior
+        finally:
+            await page_pool.release(page)
+
+async def send_messages(page_pool, phone_csv, processed_numbers, message, writer):
+    """
+    Sends WhatsApp messages to the numbers in a CSV file with one worker per page of the pool.
+
+    Numbers are streamed from the file through a bounded queue while the workers send,
+    so the first message goes out right away and the send list is never held in full.
+    Deduplication still keeps a set of every unique number read, so memory grows with
+    the number of unique inputs.
+
+    :param page_pool: PagePool of logged-in pyppeteer pages
+    :param phone_csv: str, path to the phone numbers CSV file
+    :param processed_numbers: frozenset of str, numbers that were already sent
+    :param message: str, message to send
+    :param writer: csv.writer object, to write results
+    """
+    logger.info(f"Starting to send messages on {len(page_pool)} page(s).")
 
-        logger.info(f"Completed batch {i//batch_size + 1}.")
+    queue = asyncio.Queue(maxsize=1000)
+    await asyncio.gather(
+        csv_producer(phone_csv, queue, processed_numbers, len(page_pool)),
+        *[_send_worker(page_pool, queue, message, writer) for _ in range(len(page_pool))]
+    )
 
     logger.info("Completed sending messages to all numbers.")
 
@@ -199,27 +254,24 @@ async def main():
     parser = argparse.ArgumentParser(description='Send WhatsApp messages to filtered numbers.')
     parser.add_argument('-p', '--phone_csv', default='whatsapp_numbers.csv', help='Path to the filtered WhatsApp numbers CSV file')
     parser.add_argument('-m', '--message_txt', default='message.txt', help='Path to the message text file')
-    parser.add_argument('-b', '--batch_size', type=int, default=5, help='Number of numbers to process in each batch')
     args = parser.parse_args()
 
     input_csv = args.phone_csv
     message_txt = args.message_txt
-    batch_size = args.batch_size
     output_csv = 'message_sending_results.csv'
 
-    phone_numbers = read_phone_numbers_from_csv(input_csv)
     message = read_message_from_text(message_txt)
 
-    if not phone_numbers:
+    if next(iter_phone_numbers_from_csv(input_csv), None) is None:
         logger.error("No phone numbers to process. Exiting.")
         print("No phone numbers to process. Exiting.")
         return
 
     # Read processed numbers to skip already successfully sent messages
     processed_numbers = read_processed_numbers(output_csv)
-    phone_numbers_to_send = [num for num in phone_numbers if num not in processed_numbers]
 
-    if not phone_numbers_to_send:
+    # Stops at the first unsent number, so this only reads the whole file when there is nothing to do
+    if all(num in processed_numbers for num in iter_phone_numbers_from_csv(input_csv)):
         logger.info("All phone numbers have been processed successfully. Exiting.")
         print("All phone numbers have been processed successfully. Exiting.")
         return
@@ -239,8 +291,8 @@ async def main():
     try:
         with open(output_csv, mode='a', newline='', encoding='utf-8') as result_file:
             writer = csv.writer(result_file)
-            async with get_browser_and_page() as page:
-                await send_messages_in_batches(page, phone_numbers_to_send, message, writer, batch_size=batch_size)
+            async with get_browser_and_pages(PAGE_POOL_SIZE) as page_pool:
+                await send_messages(page_pool, input_csv, processed_numbers, message, writer)
     except Exception as e:
         logger.critical(f"Unhandled exception during execution: {e}")
         print(f"An error occurred: {e}")
@@ -250,8 +302,14 @@ async def main():
         print(f"Check 'whatsapp_sender.log' for detailed logs.")
 
 if __name__ == "__main__":
+    loop_factory = uvloop_loop_factory()
     try:
-        asyncio.run(main())
+        if loop_factory is None:
+            asyncio.run(main())
+        else:
+            # Same as asyncio.run(main(), loop_factory=...), which needs Python 3.12
+            with asyncio.Runner(loop_factory=loop_factory) as runner:
+                runner.run(main())
     except Exception as e:
         logger.critical(f"Unhandled exception in main: {e}")
         print(f"An unhandled exception occurred: {e}")
@@ -1,13 +1,20 @@
 import asyncio
 import argparse
 import csv
+import json
 import os
 import random
 from pyppeteer import connect, launch
 import shutil
-import re
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from urllib.parse import urlsplit
+from urllib.request import urlopen
 
-def find_chrome_executable():
+CHROME_PATH_CACHE = Path.home() / '.cache' / 'whatsblast' / 'chrome'
+
+def _probe_chrome_executable():
     if os.name == 'nt':  # Windows
         paths = [
             os.path.join(os.getenv('LOCALAPPDATA'), 'Google', 'Chrome', 'Application', 'chrome.exe'),
@@ -30,28 +37,374 @@ def find_chrome_executable():
             return path
     return None
 
+@lru_cache(maxsize=1)
+def find_chrome_executable():
+    """
+    Returns the Chrome executable path, probing the usual install locations only on a cache miss.
+
+    The result is remembered in CHROME_PATH_CACHE so later runs skip the probe.
+
+    :return: str, path to Chrome, or None if it could not be found
+    """
+    try:
+        cached_path = CHROME_PATH_CACHE.read_text(encoding='utf-8').strip()
+        if cached_path and os.path.exists(cached_path):
+            return cached_path
+    except OSError:
+        pass  # No usable cache yet
+
+    path = _probe_chrome_executable()
+    if path:
+        try:
+            CHROME_PATH_CACHE.parent.mkdir(parents=True, exist_ok=True)
+            CHROME_PATH_CACHE.write_text(path, encoding='utf-8')
+        except OSError:
+            pass  # Caching is best effort
+    return path
+
+class _NonDigitTable(dict):
+    """
+    str.translate table that deletes every non-digit character, filled in lazily per code point.
+    """
+
+    def __missing__(self, codepoint):
+        value = codepoint if chr(codepoint).isdecimal() else None
+        self[codepoint] = value
+        return value
+
+# Use as phone_number.translate(DIGIT_TABLE) to strip '+', spaces, dashes, etc.
+DIGIT_TABLE = _NonDigitTable()
+
 CHROME_EXECUTABLE_PATH = find_chrome_executable()
 
 if not CHROME_EXECUTABLE_PATH:
     raise FileNotFoundError("Chrome executable not found. Please install Google Chrome or specify the path manually.")
 
+# Read buffer for input CSVs; large enough to cut read() syscalls on million-row files
+CSV_READ_BUFFER = 1 << 20
+
+BROWSER_ENDPOINT_FILE = '.whatsapp_endpoint'
+BROWSER_PROFILE_DIR = './.wa_profile'
+PAGE_RECYCLE_AFTER = 200
+# WhatsApp Web keeps one active tab per session, a second tab takes the session from the first
+PAGE_POOL_SIZE = 1
+# Resource types pooled pages never download, WhatsApp Web works without them
+BLOCKED_RESOURCE_TYPES = frozenset({'image', 'media', 'font', 'stylesheet'})
+
 browser_instance = None
 
+def _is_endpoint_alive(endpoint, timeout=2):
+    """
+    Checks that the browser behind a saved DevTools endpoint is still running.
+
+    pyppeteer's connect() never fails on a refused socket, it spins forever instead,
+    so the endpoint has to be probed before connecting to it.
+
+    :param endpoint: str, browser WebSocket endpoint saved by a previous run
+    :param timeout: int, seconds to wait for the browser to answer
+    :return: bool, True if that same browser answered on its HTTP endpoint
+    """
+    url = urlsplit(endpoint)
+    try:
+        with urlopen(f'http://{url.hostname}:{url.port}/json/version', timeout=timeout) as response:
+            version = json.load(response)
+    except Exception:
+        return False
+    # A different process may have taken over the port since the saved browser exited
+    return version.get('webSocketDebuggerUrl') == endpoint
+
+def _forget_browser_endpoint():
+    try:
+        os.remove(BROWSER_ENDPOINT_FILE)
+    except FileNotFoundError:
+        pass
+
+async def connect_or_launch():
+    """
+    Connects to the browser left running by a previous run, or launches a new one.
+
+    Launched browsers outlive the script: their DevTools endpoint is saved to
+    BROWSER_ENDPOINT_FILE and the profile lives in BROWSER_PROFILE_DIR, so later
+    runs skip the launch and keep the WhatsApp Web session.
+
+    :return: pyppeteer browser object
+    """
+    if os.path.exists(BROWSER_ENDPOINT_FILE):
+        with open(BROWSER_ENDPOINT_FILE, mode='r', encoding='utf-8') as file:
+            endpoint = file.read().strip()
+        if await asyncio.to_thread(_is_endpoint_alive, endpoint):
+            try:
+                return await connect(browserWSEndpoint=endpoint)
+            except Exception:
+                pass
+        _forget_browser_endpoint()  # Stale endpoint, the browser is gone
+
+    Path(BROWSER_PROFILE_DIR).mkdir(exist_ok=True)
+    browser = await launch(
+        headless=False,
+        executablePath=CHROME_EXECUTABLE_PATH,
+        userDataDir=BROWSER_PROFILE_DIR,
+        autoClose=False,
+        handleSIGINT=False,
+        handleSIGTERM=False,
+        handleSIGHUP=False,
+    )
+    with open(BROWSER_ENDPOINT_FILE, mode='w', encoding='utf-8') as file:
+        file.write(browser.wsEndpoint)
+    return browser
+
 async def get_browser_instance():
     global browser_instance
     if browser_instance is None:
-        browser_instance = await launch(headless=False, executablePath=CHROME_EXECUTABLE_PATH)  # Launch a new browser instance
+        browser_instance = await connect_or_launch()
     return browser_instance
 
+async def disconnect_browser():
+    """
+    Drops the connection to the shared browser while leaving it running for the next run.
+    """
+    global browser_instance
+    if browser_instance:
+        try:
+            await browser_instance.disconnect()
+        finally:
+            browser_instance = None
+
+async def _filter_request(request):
+    if request.resourceType in BLOCKED_RESOURCE_TYPES:
+        await request.abort()
+    else:
+        await request.continue_()
+
+async def block_heavy_resources(page):
+    """
+    Enables request interception on a page so that BLOCKED_RESOURCE_TYPES are aborted.
+
+    :param page: pyppeteer page object
+    """
+    await page.setRequestInterception(True)
+    page.on('request', lambda request: asyncio.ensure_future(_filter_request(request)))
+
+async def new_lean_page(browser):
+    """
+    Opens a new page on the browser with heavy resources blocked.
+
+    :param browser: pyppeteer browser object
+    :return: pyppeteer page object
+    """
+    page = await browser.newPage()
+    try:
+        await block_heavy_resources(page)
+    except Exception:
+        await page.close()  # Don't leave a half-set-up tab in the shared browser
+        raise
+    return page
+
+async def wait_any(page, selectors, timeout):
+    """
+    Waits for whichever of several selectors appears first and cancels the other waits.
+
+    :param page: pyppeteer page object
+    :param selectors: list of str, CSS selectors to race
+    :param timeout: int, milliseconds to wait for each selector
+    :return: tuple (str, element), the winning selector and its element, or (None, None) if none appeared
+    """
+    tasks = {asyncio.ensure_future(page.waitForSelector(selector, timeout=timeout)): selector for selector in selectors}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.exception():
+                    return tasks[task], task.result()
+        return None, None
+    finally:
+        for task in pending:
+            task.cancel()
+
+class PagePool:
+    """
+    Holds a fixed set of pre-opened pages that share one logged-in browser.
+
+    Pages are handed out with acquire() and must be given back with release()
+    so that each page only ever drives one navigation at a time. A page that has
+    served recycle_after checks is closed and replaced by a fresh one, which keeps
+    the renderer's memory bounded on long runs.
+    """
+
+    def __init__(self, browser, pages, recycle_after=PAGE_RECYCLE_AFTER):
+        self.browser = browser
+        self.pages = list(pages)
+        self.recycle_after = recycle_after
+        self._uses = {}
+        self._available = asyncio.Queue()
+        for page in self.pages:
+            self._available.put_nowait(page)
+
+    @classmethod
+    async def create(cls, browser, first_page, size, recycle_after=PAGE_RECYCLE_AFTER):
+        """
+        Builds a pool around an already logged-in page, opening size - 1 extra pages.
+
+        Every page in the pool, including first_page, has heavy resources blocked.
+
+        :param browser: pyppeteer browser object
+        :param first_page: pyppeteer page object that completed the QR scan
+        :param size: int, total number of pages in the pool
+        :param recycle_after: int, number of uses after which a page is replaced
+        :return: PagePool
+        """
+        await block_heavy_resources(first_page)
+        pages = [first_page]
+        try:
+            for _ in range(size - 1):
+                pages.append(await new_lean_page(browser))
+        except Exception:
+            # The browser outlives this run, so don't leave the extra tabs behind
+            await cls(browser, pages[1:]).close()
+            raise
+        return cls(browser, pages, recycle_after)
+
+    def __len__(self):
+        return len(self.pages)
+
+    async def acquire(self):
+        return await self._available.get()
+
+    async def release(self, page):
+        uses = self._uses.pop(page, 0) + 1
+        if uses >= self.recycle_after:
+            try:
+                fresh_page = await new_lean_page(self.browser)
+            except Exception:
+                fresh_page = None  # Keep using the old page rather than shrinking the pool
+            if fresh_page is not None:
+                # Swap the fresh page in first so close() owns it even if the old one won't close
+                self.pages[self.pages.index(page)] = fresh_page
+                try:
+                    await page.close()
+                except Exception:
+                    pass  # Old page already gone
+                page, uses = fresh_page, 0
+        self._uses[page] = uses
+        self._available.put_nowait(page)
+
+    async def close(self):
+        # Close every page even if some fail, since the browser itself stays running
+        for page in self.pages:
+            try:
+                await page.close()
+            except Exception:
+                pass  # Page already gone
+
+_CSV_SPECIAL_CHARS = frozenset(',"\r\n')
+
+def _csv_field(value):
+    """
+    Formats one CSV field the way csv.writer's default dialect would, quoting only when needed.
+    """
+    value = str(value)
+    if _CSV_SPECIAL_CHARS.isdisjoint(value):
+        return value
+    return '"' + value.replace('"', '""') + '"'
+
+def _csv_row(row):
+    """
+    Formats one CSV row, including the line terminator, the way csv.writer's default dialect would.
+    """
+    line = ','.join(map(_csv_field, row))
+    if not line and row:
+        # A lone empty field is quoted so the row doesn't read back as a blank line
+        line = '""'
+    return line + '\r\n'
+
+class CsvAppender:
+    """
+    Appends rows to a CSV file that stays open for the whole run, writing them in batches.
+
+    Rows are buffered in memory and written out every flush_every rows and on exit,
+    instead of opening and closing the file for every row. Rows are formatted directly
+    rather than through csv.writer, since they only hold phone numbers and short reasons.
+    """
+
+    def __init__(self, filename, flush_every=64):
+        self.filename = filename
+        self.flush_every = flush_every
+        self._buffer = []
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.filename, mode='a', newline='', encoding='utf-8')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+
+    def append(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(''.join(map(_csv_row, self._buffer)))
+            self._buffer.clear()
+        self._file.flush()
+
+async def bounded_as_completed(coro_factories, limit):
+    """
+    Runs coroutines with at most `limit` in flight, yielding results as they complete.
+
+    A new coroutine is started as soon as any running one finishes, and factories are
+    pulled from the iterable lazily so the full task list is never built up front.
+
+    :param coro_factories: iterable of zero-argument callables returning coroutines
+    :param limit: int, maximum number of coroutines running at the same time
+    """
+    factories = iter(coro_factories)
+    pending = {asyncio.ensure_future(factory()) for factory in islice(factories, limit)}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for factory in islice(factories, len(done)):
+                pending.add(asyncio.ensure_future(factory()))
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+def uvloop_loop_factory():
+    """
+    Returns uvloop's event loop factory when uvloop is installed, None otherwise.
+
+    :return: callable creating a uvloop event loop, or None to use stock asyncio
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return None
+    return uvloop.new_event_loop
+
 async def handle_qr_scan(page):
     """
     Handles the QR code scanning process for WhatsApp Web.
 
+    Returns right away when the persistent profile is still logged in.
+
     :param page: pyppeteer page object
     """
     await page.goto('https://web.whatsapp.com')
+    chat_list_selector = 'div[contenteditable="true"][data-tab="3"]'
+    winner, _ = await wait_any(page, [chat_list_selector, 'canvas[aria-label*="QR"]'], timeout=5000)
+    if winner == chat_list_selector:
+        return  # Session restored from the persistent profile, no scan needed
+
     print("Please scan the QR code to log in to WhatsApp Web.")
-    await page.waitForSelector('div[contenteditable="true"][data-tab="3"]', timeout=60000)  # Wait up to 60 seconds for QR scan
+    await page.waitForSelector(chat_list_selector, timeout=60000)  # Wait up to 60 seconds for QR scan
 
 async def send_messages_to_multiple_numbers(phone_numbers, message, writer):
     """
@@ -107,6 +460,7 @@ async def close_browser():
     if browser_instance:
         await browser_instance.close()
         browser_instance = None
+        _forget_browser_endpoint()
         
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Send WhatsApp messages to filtered numbers.')
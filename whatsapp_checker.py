@@ -1,12 +1,17 @@
 import asyncio
 import csv
+import json
 import os
-import re
 import logging
-from pyppeteer import launch
-from utils import find_chrome_executable, get_browser_instance, handle_qr_scan
+from pyppeteer import errors, launch
+from utils import CSV_READ_BUFFER, DIGIT_TABLE, PAGE_POOL_SIZE, CsvAppender, PagePool, bounded_as_completed, disconnect_browser, find_chrome_executable, get_browser_instance, handle_qr_scan, uvloop_loop_factory
 from contextlib import asynccontextmanager
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logging.basicConfig(
     filename='whatsapp_checker.log',
@@ -14,54 +19,90 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Resolves to the chat state once the chat input or an error message is on the page
+PAGE_STATE_JS = '''() => {
+    if (document.querySelector('div[contenteditable="true"][data-tab="10"]')) {
+        return {state: 'ok'};
+    }
+    // Another tab on the same session took over, leaving only a "Use here" button
+    const buttons = document.querySelectorAll('button, div[role="button"]');
+    if (Array.from(buttons).some((button) => /^use here$/i.test(button.textContent.trim()))) {
+        return {state: 'taken_over'};
+    }
+    const invalid = document.querySelector('div._3J6wB');
+    if (invalid) {
+        return {state: 'invalid', msg: invalid.textContent.trim()};
+    }
+    const error = document.querySelector('div[data-animate-modal-body="true"]');
+    if (error) {
+        return {state: 'error', msg: error.textContent.trim()};
+    }
+    return null;
+}'''
+
+class SessionTakenOverError(Exception):
+    """
+    Raised when WhatsApp Web shows its "open in another window" screen instead of the chat.
+
+    The number was never actually checked, so it must not be recorded as a result.
+    """
+
+def _dump_result(record):
+    if orjson is not None:
+        return orjson.dumps(record) + b'\n'
+    return json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+
+def _load_result(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
 @asynccontextmanager
-async def get_browser_and_page():
+async def get_browser_and_pages(pool_size):
     """
-    Initializes the browser and page, handles QR scan, and ensures proper cleanup.
+    Initializes the browser and a pool of pages, handles QR scan, and ensures proper cleanup.
+
+    :param pool_size: int, number of pages to open on the logged-in browser
     """
-    browser = await get_browser_instance()
-    page = await browser.newPage()
-    await handle_qr_scan(page)
+    page = pool = None
     try:
-        yield page
+        browser = await get_browser_instance()
+        page = await browser.newPage()
+        await handle_qr_scan(page)
+        pool = await PagePool.create(browser, page, pool_size)
+        yield pool
     except Exception as e:
         logging.error(f"Error within browser context: {e}")
         raise
     finally:
+        # The browser stays running for the next run, so close every tab this run opened
         try:
-            await page.close()
-            await browser.close()
+            if pool is not None:
+                await pool.close()
+            elif page is not None:
+                await page.close()
         except Exception as e:
-            logging.error(f"Error closing browser/page: {e}")
-
-def append_number_to_file(number, filename, include_reason=False, reason=''):
-    """
-    Appends a phone number (and optionally a reason) to the specified CSV file.
-    """
-    try:
-        with open(filename, mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            if include_reason:
-                writer.writerow([number, reason])
-            else:
-                writer.writerow([number])
-    except Exception as e:
-        logging.error(f"Failed to append number to {filename}: {e}")
+            logging.error(f"Error closing pages: {e}")
+        try:
+            await disconnect_browser()
+        except Exception as e:
+            logging.error(f"Error disconnecting browser: {e}")
 
-def read_existing_numbers(filename):
+def iter_existing_numbers(filename):
     """
-    Reads existing numbers from a CSV file to avoid reprocessing.
+    Yields the cleaned numbers already recorded in a CSV file, to avoid reprocessing them.
     """
     if not os.path.exists(filename):
-        return set()
+        return
     try:
-        with open(filename, mode='r', newline='', encoding='utf-8') as file:
+        with open(filename, mode='r', newline='', encoding='utf-8', buffering=CSV_READ_BUFFER) as file:
             reader = csv.reader(file)
-            headers = next(reader, None)  # Skip header
-            return {row[0] for row in reader if row}
+            next(reader, None)  # Skip header
+            for row in reader:
+                if row:
+                    yield row[0].translate(DIGIT_TABLE)
     except Exception as e:
         logging.error(f"Failed to read numbers from {filename}: {e}")
-        return set()
 
 async def is_number_on_whatsapp(page, phone_number, max_retries=3):
     """
@@ -71,73 +112,127 @@ async def is_number_on_whatsapp(page, phone_number, max_retries=3):
     :param phone_number: str, phone number to check
     :param max_retries: int, number of retries for transient errors
     :return: tuple (bool, str), (True if the number is on WhatsApp, error message if any)
+    :raises SessionTakenOverError: if another tab kept the session through every retry
     """
     for attempt in range(1, max_retries + 1):
         try:
-            cleaned_number = re.sub(r'\D', '', phone_number)
+            cleaned_number = phone_number.translate(DIGIT_TABLE)
             chat_url = f'https://web.whatsapp.com/send?phone={cleaned_number}'
-            await page.goto(chat_url, {'waitUntil': 'networkidle0', 'timeout': 90000})  # Increased timeout
-            await asyncio.sleep(5)  # Adjusted wait time
+            await page.goto(chat_url, {'waitUntil': 'domcontentloaded', 'timeout': 90000})  # Increased timeout
+
+            # One in-page poll covers the chat input and both error messages, and reads the error text
+            try:
+                handle = await page.waitForFunction(PAGE_STATE_JS, {'polling': 'mutation', 'timeout': 15000})
+            except errors.TimeoutError:
+                # If no chat input or error message is found, assume it's not on WhatsApp
+                return False, "Number not found on WhatsApp"
 
-            # Check for chat input
-            chat_input = await page.querySelector('div[contenteditable="true"][data-tab="10"]')
-            if chat_input:
+            result = await handle.jsonValue()
+            if result['state'] == 'ok':
                 return True, ""
-            
-            # Check for invalid number message
-            invalid_number_selector = 'div._3J6wB'
-            invalid_number_element = await page.querySelector(invalid_number_selector)
-            if invalid_number_element:
-                error_text = await page.evaluate('(element) => element.textContent', invalid_number_element)
-                return False, error_text.strip()
-
-            # Check for general error message
-            error_selector = 'div[data-animate-modal-body="true"]'
-            error_element = await page.querySelector(error_selector)
-            if error_element:
-                error_text = await page.evaluate('(element) => element.textContent', error_element)
-                return False, error_text.strip()
-
-            # If no chat input or error message is found, assume it's not on WhatsApp
-            return False, "Number not found on WhatsApp"
+            if result['state'] == 'taken_over':
+                raise SessionTakenOverError("WhatsApp Web is open in another tab or window")
+            return False, result['msg']
 
+        except SessionTakenOverError as e:
+            logging.warning(f"Attempt {attempt} failed for {phone_number}: {e}")
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(2)  # Wait before retrying
         except Exception as e:
             logging.warning(f"Attempt {attempt} failed for {phone_number}: {e}")
             if attempt == max_retries:
                 return False, str(e)
             await asyncio.sleep(2)  # Wait before retrying
 
-async def check_numbers_on_whatsapp(phone_numbers, whatsapp_csv, non_whatsapp_csv, batch_size=5):
+def split_results_log(results_log, whatsapp_csv, non_whatsapp_csv):
     """
-    Processes phone numbers in batches to check their WhatsApp registration status.
+    Appends every result from the combined JSONL log to the two CSVs, then removes the log.
+
+    :param results_log: path to the JSONL log written during a run
+    :param whatsapp_csv: path to save WhatsApp-registered numbers
+    :param non_whatsapp_csv: path to save non-WhatsApp numbers with reasons
+    """
+    if not os.path.exists(results_log):
+        return
+    try:
+        with open(results_log, mode='rb', buffering=CSV_READ_BUFFER) as log, \
+                CsvAppender(whatsapp_csv) as whatsapp_sink, \
+                CsvAppender(non_whatsapp_csv) as non_whatsapp_sink:
+            for line in log:
+                try:
+                    record = _load_result(line)
+                except ValueError:
+                    continue  # Blank or half-written line left by a crash
+                if record['ok']:
+                    whatsapp_sink.append([record['n']])
+                else:
+                    non_whatsapp_sink.append([record['n'], record['r']])
+        os.remove(results_log)
+    except Exception as e:
+        logging.error(f"Failed to split {results_log} into result CSVs: {e}")
+
+async def _check_one(pool, phone_number, log):
+    """
+    Checks a single number on a page borrowed from the pool and logs the result.
+    """
+    page = await pool.acquire()
+    try:
+        try:
+            is_on_whatsapp, error_message = await is_number_on_whatsapp(page, phone_number)
+        except SessionTakenOverError as e:
+            # Not a result, leave the number unrecorded so the next run checks it again
+            logging.error(f"Could not check {phone_number}: {e}")
+            return
+        if is_on_whatsapp:
+            logging.info(f"{phone_number} is on WhatsApp.")
+        else:
+            logging.info(f"{phone_number} is not on WhatsApp. Reason: {error_message}")
+        log.write(_dump_result({'n': phone_number, 'ok': is_on_whatsapp, 'r': error_message}))
+
+        await asyncio.sleep(1)  # Rate limiting, per page
+    finally:
+        await pool.release(page)
+
+async def check_numbers_on_whatsapp(phone_numbers, whatsapp_csv, non_whatsapp_csv,
+                                    results_log='whatsapp_results.jsonl'):
+    """
+    Checks the WhatsApp registration status of phone numbers.
+
+    One check runs per pooled page, and a new one starts as soon as any finishes.
+    Results go to a single append-only JSONL log during the run and are split into
+    the two CSVs at the end.
 
     :param phone_numbers: list of phone numbers to check
     :param whatsapp_csv: path to save WhatsApp-registered numbers
     :param non_whatsapp_csv: path to save non-WhatsApp numbers with reasons
-    :param batch_size: number of numbers to process in each batch
+    :param results_log: path to the JSONL log holding this run's results
     """
-    existing_whatsapp_numbers = read_existing_numbers(whatsapp_csv)
-    existing_non_whatsapp_numbers = read_existing_numbers(non_whatsapp_csv)
-    processed_numbers = existing_whatsapp_numbers.union(existing_non_whatsapp_numbers)
+    # Recover results from a run that died before it could split its log
+    split_results_log(results_log, whatsapp_csv, non_whatsapp_csv)
+
+    processed_numbers = set()
+    processed_numbers.update(iter_existing_numbers(whatsapp_csv))
+    processed_numbers.update(iter_existing_numbers(non_whatsapp_csv))
 
     phone_numbers_to_check = [num for num in phone_numbers if num not in processed_numbers]
     total_numbers = len(phone_numbers_to_check)
     logging.info(f"Starting to check {total_numbers} numbers.")
 
-    async with get_browser_and_page() as page:
-        for i in range(0, total_numbers, batch_size):
-            batch = phone_numbers_to_check[i:i+batch_size]
-            logging.info(f"Processing batch {i//batch_size + 1}: {len(batch)} numbers.")
-            for phone_number in batch:
-                is_on_whatsapp, error_message = await is_number_on_whatsapp(page, phone_number)
-                if is_on_whatsapp:
-                    logging.info(f"{phone_number} is on WhatsApp.")
-                    append_number_to_file(phone_number, whatsapp_csv)
-                else:
-                    logging.info(f"{phone_number} is not on WhatsApp. Reason: {error_message}")
-                    append_number_to_file(phone_number, non_whatsapp_csv, include_reason=True, reason=error_message)
-                
-                await asyncio.sleep(1)  # Rate limiting
+    try:
+        async with get_browser_and_pages(PAGE_POOL_SIZE) as pool:
+            with open(results_log, mode='ab', buffering=1 << 16) as log:
+                checks = (
+                    lambda num=num: _check_one(pool, num, log)
+                    for num in phone_numbers_to_check
+                )
+                checked = 0
+                async for _ in bounded_as_completed(checks, len(pool)):
+                    checked += 1
+                    if checked % 100 == 0:
+                        logging.info(f"Checked {checked}/{total_numbers} numbers.")
+    finally:
+        split_results_log(results_log, whatsapp_csv, non_whatsapp_csv)
 
     logging.info("Completed checking all numbers.")
 
@@ -165,19 +260,17 @@ def save_numbers_to_file(numbers, filename, include_reason=False):
 
 def read_phone_numbers_from_csv(file_path):
     """
-    Reads phone numbers from a CSV file.
+    Reads phone numbers from a CSV file and strips any non-digit characters.
 
     :param file_path: path to the CSV file
-    :return: list of phone numbers
+    :return: list of cleaned phone numbers
     """
     phone_numbers = []
     try:
-        with open(file_path, mode='r') as file:
+        with open(file_path, mode='r', newline='', encoding='utf-8', buffering=CSV_READ_BUFFER) as file:
             reader = csv.reader(file)
-            headers = next(reader, None)  # Skip the header
-            for row in reader:
-                if row:
-                    phone_numbers.append(row[0])
+            next(reader, None)  # Skip the header
+            phone_numbers = [row[0].translate(DIGIT_TABLE) for row in reader if row]
     except Exception as e:
         logging.error(f"Failed to read phone numbers from {file_path}: {e}")
     return phone_numbers
@@ -218,7 +311,13 @@ async def main():
     logging.info("Script execution completed.")
 
 if __name__ == "__main__":
+    loop_factory = uvloop_loop_factory()
     try:
-        asyncio.run(main())
+        if loop_factory is None:
+            asyncio.run(main())
+        else:
+            # Same as asyncio.run(main(), loop_factory=...), which needs Python 3.12
+            with asyncio.Runner(loop_factory=loop_factory) as runner:
+                runner.run(main())
     except Exception as e:
         logging.critical(f"Unhandled exception: {e}")
\ No newline at end of file